@@ -2,7 +2,11 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+from openpyxl import Workbook
 from io import BytesIO
 from datetime import date, timedelta
 
@@ -19,47 +23,166 @@ KPI_THRESHOLDS = {
     "landingdoorlockrollerclearance": (None, 0.029)
 }
 
+# Explicit formats keep pd.to_datetime on its C parser; mm/dd/yyyy first
+DATE_FORMATS = ["%m/%d/%Y", "%m-%d-%Y", "%Y-%m-%d"]
+
+# Floor line colours, cycled per KPI chart
+PALETTE = ["#1f77b4","#ff7f0e","#2ca02c","#d62728","#9467bd","#8c564b","#e377c2","#7f7f7f"]
+
+# ---------------- Columns ----------------
+REQUIRED_COLUMNS = ["ckpi_statistics_date","ave","ckpi","floor","eq"]
+date_col, ave_col, ckpi_col, floor_col, eq_col = REQUIRED_COLUMNS
+
 # ---------------- Helpers ----------------
-def read_file(uploaded):
-    name = uploaded.name.lower()
-    if name.endswith(".xlsx"):
-        return pd.read_excel(uploaded, engine="openpyxl")
-    if name.endswith(".xls"):
-        return pd.read_excel(uploaded, engine="xlrd")
+def source_columns(names):
+    """Original column names matching REQUIRED_COLUMNS case-insensitively (None = all)"""
+    # None when nothing matches, so the missing-column check reports the real problem
+    return [c for c in names if str(c).lower() in REQUIRED_COLUMNS] or None
+
+def read_csv(uploaded):
+    # Read the header first so projection and dtypes use the file's own column names
+    columns = source_columns(pd.read_csv(uploaded, nrows=0).columns)
+    uploaded.seek(0)
+    dtype = {c: "category" for c in columns or [] if str(c).lower() == ckpi_col}
+    return pd.read_csv(uploaded, usecols=columns, dtype=dtype, engine="c")
+
+def read_feather(uploaded):
+    # Feather V2 / Arrow IPC file: peek at the schema and read only the required columns
+    try:
+        columns = source_columns(pa.ipc.open_file(uploaded).schema.names)
+    except pa.ArrowInvalid:
+        pass
+    else:
+        uploaded.seek(0)
+        return pd.read_feather(uploaded, columns=columns)
+    # Feather V1 has no separate schema peek, so it is read in full
+    uploaded.seek(0)
+    try:
+        return pd.read_feather(uploaded)
+    except pa.ArrowInvalid:
+        pass
+    # .arrow written in the IPC stream format
+    uploaded.seek(0)
+    table = pa.ipc.open_stream(uploaded).read_all()
+    return table.select(source_columns(table.schema.names) or table.schema.names).to_pandas()
+
+def read_file(uploaded, name):
+    name = name.lower()
+    # Columnar formats: read only the required columns from the file
+    if name.endswith(".parquet"):
+        columns = source_columns(pq.read_schema(uploaded).names)
+        uploaded.seek(0)
+        return pd.read_parquet(uploaded, engine="pyarrow", columns=columns)
+    if name.endswith((".feather", ".arrow")):
+        return read_feather(uploaded)
+    if name.endswith((".xlsx", ".xls")):
+        # calamine reads both formats natively without openpyxl's full XML DOM
+        return pd.read_excel(uploaded, engine="calamine")
     if name.endswith(".csv"):
-        return pd.read_csv(uploaded)
+        return read_csv(uploaded)
     if name.endswith(".json"):
         return pd.read_json(uploaded)
-    return pd.read_csv(uploaded)
+    return read_csv(uploaded)
 
 def parse_dates(df, col):
     # Parse mm/dd/yyyy properly
+    if pd.api.types.is_datetime64_any_dtype(df[col]):
+        return df
+    present = df[col].notna().sum()
+    for fmt in DATE_FORMATS:
+        parsed = pd.to_datetime(df[col], format=fmt, errors="coerce")
+        if parsed.notna().sum() == present:
+            df[col] = parsed
+            return df
+    # Mixed or unexpected formats: fall back to per-element inference
     df[col] = pd.to_datetime(df[col], dayfirst=False, errors="coerce")
     return df
 
-def detect_peaks_lows(values, low_thresh, high_thresh, std_factor=1.0):
-    arr = np.asarray(values, dtype=float)
-    n = len(arr)
-    peaks, lows = [], []
-    if n < 3 or np.isnan(arr).all():
-        return peaks, lows
-    mean, std = np.nanmean(arr), np.nanstd(arr)
-    upper_stat, lower_stat = mean + std_factor*std, mean - std_factor*std
-    for i in range(1, n-1):
-        a, b, c = arr[i-1], arr[i], arr[i+1]
-        if np.isnan(b): continue
-        if not np.isnan(a) and not np.isnan(c):
-            if b > a and b > c and ((high_thresh is not None and b > high_thresh) or b > upper_stat):
-                peaks.append(i)
-            if b < a and b < c and ((low_thresh is not None and b < low_thresh) or b < lower_stat):
-                lows.append(i)
-    return peaks, lows
+@st.cache_data(show_spinner=False)
+def load_df(file_bytes, name):
+    """Parse the upload once per file; widget reruns reuse the prepared frame."""
+    df = read_file(BytesIO(file_bytes), name)
+    df.columns = [str(c).lower() for c in df.columns]
+    if date_col in df.columns:
+        df = parse_dates(df, date_col)
+        if isinstance(df[date_col].dtype, pd.DatetimeTZDtype):
+            # Keep local wall-clock times: .values would shift tz-aware dates to UTC
+            df[date_col] = df[date_col].dt.tz_localize(None)
+    if ave_col in df.columns:
+        # float32 is ample for the readings and halves memory traffic downstream
+        df[ave_col] = pd.to_numeric(df[ave_col], errors="coerce").astype("float32")
+    if ckpi_col in df.columns:
+        # Lowercase once and filter on integer category codes afterwards
+        df[ckpi_col] = df[ckpi_col].astype("string[pyarrow]").str.lower().astype("category")
+    for col in (eq_col, floor_col):
+        # Arrow-backed strings: contiguous buffers, and isin/sort run in Arrow kernels.
+        # Numeric or mixed columns are left alone so floors keep their numeric order.
+        if col in df.columns and pd.api.types.infer_dtype(df[col], skipna=True) == "string":
+            df[col] = df[col].astype("string[pyarrow]")
+    return df
+
+@st.cache_data(show_spinner=False)
+def filter_df(df, selected_eq, selected_floors, selected_kpis, start_date, end_date):
+    """Apply the sidebar filters and sort by (ckpi, floor, date); cached on the filter tuple."""
+    # Build the lookup sets once; pandas hashes an Index's values directly in isin/get_indexer
+    eq_set, floor_set = pd.Index(selected_eq), pd.Index(selected_floors)
+    kpi_set = pd.Index([k.lower() for k in selected_kpis])
+    wanted_codes = df[ckpi_col].cat.categories.get_indexer(kpi_set)
+    wanted_codes = wanted_codes[wanted_codes >= 0]  # -1 would match missing KPIs
+    # Inclusive end-of-day bound, compared as datetime64 instead of per-row date objects
+    lo = pd.Timestamp(start_date).to_datetime64()
+    hi = (pd.Timestamp(end_date) + pd.Timedelta(days=1) - pd.Timedelta(nanoseconds=1)).to_datetime64()
+    dates = df[date_col].values
+    mask = (
+        df[eq_col].isin(eq_set).values &
+        df[floor_col].isin(floor_set).values &
+        np.isin(df[ckpi_col].cat.codes.values, wanted_codes) &
+        (dates >= lo) & (dates <= hi)
+    )
+    # Carry only the columns the dashboard uses through the filter and sort
+    df = df.loc[mask, REQUIRED_COLUMNS]
+    # Sorted once so every (kpi, floor) group is already in date order
+    return df.sort_values([ckpi_col, floor_col, date_col], kind="stable")
+
+def detect_peaks_lows(values, groups, low_thresh, high_thresh, std_factor=1.0):
+    """Peak/low boolean masks for every row; stats and neighbours stay within each group"""
+    b = values.to_numpy(dtype=np.float32, na_value=np.nan)
+    codes, uniques = pd.factorize(groups)
+    # Per-group mean and population std from a single NaN mask: the valid values are
+    # gathered once and reused for the sum and the squared-deviation pass
+    valid = ~np.isnan(b) & (codes >= 0)
+    v, g = b[valid].astype(np.float64), codes[valid]
+    n = np.bincount(g, minlength=len(uniques))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.bincount(g, weights=v, minlength=len(uniques)) / n
+        std = np.sqrt(np.bincount(g, weights=(v - mean[g])**2, minlength=len(uniques)) / n)
+    # Trailing NaN bound so rows without a group (code -1) can never match
+    upper_stat = np.append(mean + std_factor*std, np.nan).astype(np.float32)[codes]
+    lower_stat = np.append(mean - std_factor*std, np.nan).astype(np.float32)[codes]
+    # Neighbours are shifted within each group, so group edges see NaN.
+    # Any comparison involving NaN is False, so no separate validity mask is needed,
+    # and the masks are built in place to keep temporaries to one per comparison.
+    grouped = values.groupby(groups, sort=False, observed=True)
+    a = grouped.shift(1).to_numpy(dtype=np.float32, na_value=np.nan)
+    c = grouped.shift(-1).to_numpy(dtype=np.float32, na_value=np.nan)
+    peak_mask = b > upper_stat
+    if high_thresh is not None:
+        peak_mask |= b > high_thresh
+    peak_mask &= b > a
+    peak_mask &= b > c
+    low_mask = b < lower_stat
+    if low_thresh is not None:
+        low_mask |= b < low_thresh
+    low_mask &= b < a
+    low_mask &= b < c
+    return peak_mask, low_mask
 
 def point_status(value, thresh):
     """Return 'ok' (green) or 'corrective' (yellow)"""
     if value is None or np.isnan(value):
         return "nodata"
-    low, high = thresh
+    # ave is float32: compare thresholds in float32 too, whatever NumPy's promotion rules
+    low, high = (None if t is None else np.float32(t) for t in thresh)
     if low is not None and high is not None:
         return "ok" if low <= value <= high else "corrective"
     if low is None and high is not None:
@@ -68,25 +191,101 @@ def point_status(value, thresh):
         return "ok" if value >= low else "corrective"
     return "corrective"
 
-def color_cycle(i):
-    palette = ["#1f77b4","#ff7f0e","#2ca02c","#d62728","#9467bd","#8c564b","#e377c2","#7f7f7f"]
-    return palette[i % len(palette)]
-
+@st.cache_data(show_spinner=False)
 def df_to_excel_bytes(df_):
+    """Encode the report as .xlsx bytes; cached so reruns only re-encode a changed report"""
+    # Write-only workbook streams rows out instead of holding the whole sheet in memory
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Actionable_Report")
+    ws.append(list(df_.columns))
+    for row in df_.itertuples(index=False):
+        ws.append(list(row))
     out = BytesIO()
-    with pd.ExcelWriter(out, engine="openpyxl") as writer:
-        df_.to_excel(writer, index=False, sheet_name="Actionable_Report")
-    out.seek(0)
-    return out
+    wb.save(out)
+    return out.getvalue()
+
+@st.cache_resource(max_entries=32)
+def build_figure(kpi_names, df_plot, std_factor):
+    """Plot one subplot row per KPI, per floor with peaks/lows; returns (figure, per-floor summary columns)"""
+    fig = make_subplots(
+        rows=len(kpi_names), cols=1, subplot_titles=[f"KPI: {k}" for k in kpi_names],
+        shared_xaxes=True, vertical_spacing=0.04
+    )
+    summary = {"kpi": [], "floor": [], "peaks": [], "lows": [], "rows": []}
+    kpi_frames = {kpi: part for kpi, part in df_plot.groupby(ckpi_col, sort=False, observed=True)}
+    for row, kpi_name in enumerate(kpi_names, start=1):
+        df_kpi = kpi_frames[kpi_name.lower()]
+        low_thresh, high_thresh = KPI_THRESHOLDS.get(kpi_name.lower(), (None, None))
+        # Detect peaks/lows for all floors in one pass, then split per floor for plotting
+        peak_mask, low_mask = detect_peaks_lows(df_kpi[ave_col], df_kpi[floor_col], low_thresh, high_thresh, std_factor)
+        floor_groups = df_kpi.groupby(floor_col, sort=False, observed=True)
+        colors = [PALETTE[i % len(PALETTE)] for i in range(floor_groups.ngroups)]
+        # Group legend entries by KPI so repeated floor names stay distinguishable
+        legend = dict(legendgroup=kpi_name, legendgrouptitle_text=kpi_name)
+        for i, (floor, df_floor) in enumerate(floor_groups):
+            pos = floor_groups.indices[floor]
+            peaks, lows = np.flatnonzero(peak_mask[pos]), np.flatnonzero(low_mask[pos])
+            x_arr, y_arr = df_floor[date_col].to_numpy(), df_floor[ave_col].to_numpy()
+
+            # Determine point colors
+            status_colors = [
+                "#2ca02c" if point_status(v, (low_thresh, high_thresh)) == "ok" else "#ffcc00"
+                for v in y_arr
+            ]
+
+            # Main line (floor)
+            fig.add_trace(go.Scatter(
+                x=x_arr,
+                y=y_arr,
+                mode="lines+markers",
+                name=f"Floor {floor}",
+                line=dict(color=colors[i], width=2),
+                marker=dict(size=8, color=status_colors, line=dict(color="#000", width=1)),
+                hovertemplate="Date: %{x|%m/%d/%Y}<br>Floor: "+str(floor)+"<br>ave: %{y:.2f}<extra></extra>",
+                **legend
+            ), row=row, col=1)
+
+            fig.add_trace(go.Scatter(
+                x=x_arr[peaks],
+                y=y_arr[peaks],
+                mode="markers",
+                marker=dict(symbol="triangle-up", color="red", size=11),
+                name=f"Peaks (Floor {floor})",
+                **legend
+            ), row=row, col=1)
+            fig.add_trace(go.Scatter(
+                x=x_arr[lows],
+                y=y_arr[lows],
+                mode="markers",
+                marker=dict(symbol="triangle-down", color="blue", size=11),
+                name=f"Lows (Floor {floor})",
+                **legend
+            ), row=row, col=1)
+
+            summary["kpi"].append(kpi_name)
+            summary["floor"].append(floor)
+            summary["peaks"].append(len(peaks))
+            summary["lows"].append(len(lows))
+            summary["rows"].append(len(df_floor))
+
+        fig.update_yaxes(title_text="ave", row=row, col=1)
+
+    fig.update_xaxes(title_text="Date", row=len(kpi_names), col=1)
+    fig.update_layout(
+        height=500*len(kpi_names),
+        hovermode="closest",
+        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
+    )
+    return fig, summary
 
 # ---------------- Upload ----------------
-uploaded = st.file_uploader("Upload KPI file", type=["xlsx","xls","csv","json"])
+uploaded = st.file_uploader("Upload KPI file", type=["xlsx","xls","csv","json","parquet","feather","arrow"])
 if not uploaded:
     st.info("Upload a KPI file to begin.")
     st.stop()
 
 try:
-    df = read_file(uploaded)
+    df = load_df(uploaded.getvalue(), uploaded.name)
 except Exception as e:
     st.error(f"Could not read file: {e}")
     st.stop()
@@ -95,15 +294,11 @@ if df.empty:
     st.error("Uploaded file is empty.")
     st.stop()
 
-cols_lower = {c.lower(): c for c in df.columns}
-required = ["ckpi_statistics_date","ave","ckpi","floor","eq"]
-for req in required:
-    if req not in cols_lower:
+for req in REQUIRED_COLUMNS:
+    if req not in df.columns:
         st.error(f"Required column '{req}' not found in file.")
         st.stop()
 
-date_col, ave_col, ckpi_col, floor_col, eq_col = [cols_lower[c] for c in required]
-df = parse_dates(df, date_col)
 if df[date_col].isna().all():
     st.error("Could not parse any dates. Please ensure format is mm/dd/yyyy.")
     st.stop()
@@ -139,85 +334,26 @@ else:
 std_factor = st.sidebar.slider("Peak/Low Sensitivity", 0.5, 3.0, 1.0, 0.1)
 
 # ---------------- Apply Filters ----------------
-df_filtered = df[
-    df[eq_col].isin(selected_eq) &
-    df[floor_col].isin(selected_floors) &
-    df[ckpi_col].str.lower().isin([k.lower() for k in selected_kpis]) &
-    (df[date_col].dt.date >= start_date) & (df[date_col].dt.date <= end_date)
-]
+df_filtered = filter_df(
+    df, tuple(selected_eq), tuple(selected_floors), tuple(selected_kpis), start_date, end_date
+)
 
 if df_filtered.empty:
     st.warning("No data after applying filters.")
     st.stop()
 
 # ---------------- KPI Graphs ----------------
-kpi_summary = []
+present_kpis = set(df_filtered[ckpi_col].unique())
 for kpi_name in selected_kpis:
-    df_kpi = df_filtered[df_filtered[ckpi_col].str.lower() == kpi_name.lower()]
-    if df_kpi.empty:
+    if kpi_name.lower() not in present_kpis:
         st.info(f"No data for KPI: {kpi_name}")
-        continue
-
-    st.subheader(f"KPI: {kpi_name}")
-    fig = go.Figure()
-    floors = sorted(df_kpi[floor_col].dropna().unique())
-    for i, floor in enumerate(floors):
-        df_floor = df_kpi[df_kpi[floor_col] == floor].sort_values(date_col)
-        if df_floor.empty: continue
-        color = color_cycle(i)
-
-        # Determine thresholds and point colors
-        low_thresh, high_thresh = KPI_THRESHOLDS.get(kpi_name.lower(), (None, None))
-        status_colors = [
-            "#2ca02c" if point_status(v, (low_thresh, high_thresh)) == "ok" else "#ffcc00"
-            for v in df_floor[ave_col]
-        ]
-
-        # Main line (floor)
-        fig.add_trace(go.Scatter(
-            x=df_floor[date_col],
-            y=df_floor[ave_col],
-            mode="lines+markers",
-            name=f"Floor {floor}",
-            line=dict(color=color, width=2),
-            marker=dict(size=8, color=status_colors, line=dict(color="#000", width=1)),
-            hovertemplate="Date: %{x|%m/%d/%Y}<br>Floor: "+str(floor)+"<br>ave: %{y:.2f}<extra></extra>"
-        ))
-
-        # Detect peaks/lows
-        peaks, lows = detect_peaks_lows(df_floor[ave_col].values, low_thresh, high_thresh, std_factor)
-
-        fig.add_trace(go.Scatter(
-            x=df_floor[date_col].values[peaks],
-            y=df_floor[ave_col].values[peaks],
-            mode="markers",
-            marker=dict(symbol="triangle-up", color="red", size=11),
-            name=f"Peaks (Floor {floor})"
-        ))
-        fig.add_trace(go.Scatter(
-            x=df_floor[date_col].values[lows],
-            y=df_floor[ave_col].values[lows],
-            mode="markers",
-            marker=dict(symbol="triangle-down", color="blue", size=11),
-            name=f"Lows (Floor {floor})"
-        ))
-
-        kpi_summary.append({
-            "kpi": kpi_name,
-            "floor": floor,
-            "peaks": len(peaks),
-            "lows": len(lows),
-            "rows": len(df_floor)
-        })
+plotted_kpis = tuple(k for k in selected_kpis if k.lower() in present_kpis)
 
-    fig.update_layout(
-        xaxis_title="Date",
-        yaxis_title="ave",
-        height=500,
-        hovermode="closest",
-        legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
-    )
-    st.plotly_chart(fig, use_container_width=True)
+# One subplot figure for every KPI, cached on (KPIs, plotted columns, sensitivity)
+fig, kpi_summary = build_figure(
+    plotted_kpis, df_filtered[[ckpi_col, date_col, floor_col, ave_col]], std_factor
+)
+st.plotly_chart(fig, use_container_width=True)
 
 # ---------------- Actionable Insights ----------------
 st.subheader("⚡ Actionable Insights Report ⚡")
@@ -227,17 +363,16 @@ solution_map = {
     3: "This is the reason for the error"
 }
 
-report_rows = []
-for rec in kpi_summary:
-    if rec['peaks'] + rec['lows'] > rec['rows'] * 0.2:
-        report_rows.append({
-            "KPI": rec['kpi'],
-            "Floor": rec['floor'],
-            "Action Needed": "⚠️ High uncertainty → Technician check",
-            "Remedy / Reason": solution_map.get((rec['peaks'] + rec['lows']) % 3 + 1)
-        })
-
-report_df = pd.DataFrame(report_rows)
+summary_df = pd.DataFrame(kpi_summary)
+flagged = (summary_df["peaks"] + summary_df["lows"]).to_numpy(dtype=int)
+mask = flagged > summary_df["rows"].to_numpy(dtype=int) * 0.2
+report_df = pd.DataFrame({
+    "KPI": summary_df["kpi"].to_numpy()[mask],
+    "Floor": summary_df["floor"].to_numpy()[mask],
+    "Action Needed": "⚠️ High uncertainty → Technician check",
+    # solution_map keys are 1..3, so (count % 3) indexes its values directly
+    "Remedy / Reason": np.take(list(solution_map.values()), flagged[mask] % 3)
+})
 if not report_df.empty:
     st.dataframe(report_df)
     st.download_button(